@@ -19,21 +19,20 @@
 import glob
 import logging
 import os
+import shutil
 import subprocess
 import sys
-import unittest
-from copy import deepcopy
+import tempfile
+from functools import lru_cache
+from itertools import chain
 from os.path import dirname, relpath
 from textwrap import wrap
-from typing import Dict, List
+from typing import TYPE_CHECKING, Callable, Dict, FrozenSet, Iterable, List, Set, Tuple, Type
 
-from setuptools import Command, Distribution, find_namespace_packages, setup
-from setuptools.command.develop import develop as develop_orig
-from setuptools.command.install import install as install_orig
+from setuptools import Command, Distribution, setup
 
-# Setuptools patches this import to point to a vendored copy instead of the
-# stdlib, which is deprecated in Python 3.10 and will be removed in 3.12.
-from distutils import log  # isort: skip
+if TYPE_CHECKING:
+    import unittest
 
 # Controls whether providers are installed from packages or directly from sources
 # It is turned on by default in case of development environments such as Breeze
@@ -49,8 +48,10 @@ version = '2.3.0.dev0'
 my_dir = dirname(__file__)
 
 
-def airflow_test_suite() -> unittest.TestSuite:
+def airflow_test_suite() -> "unittest.TestSuite":
     """Test suite for Airflow tests"""
+    import unittest
+
     test_loader = unittest.TestLoader()
     test_suite = test_loader.discover(os.path.join(my_dir, 'tests'), pattern='test_*.py')
     return test_suite
@@ -72,24 +73,37 @@ class CleanCommand(Command):
         """Set final values for options."""
 
     @staticmethod
-    def rm_all_files(files: List[str]) -> None:
+    def rm_all_files(files: Iterable[str]) -> None:
         """Remove all files from the list"""
         for file in files:
             try:
                 os.remove(file)
-            except Exception as e:
+            except FileNotFoundError:
+                # Already gone - nothing to clean
+                pass
+            except OSError as e:
                 logger.warning("Error when removing %s: %s", file, e)
 
+    @staticmethod
+    def rm_all_compiled_files() -> None:
+        """Remove all __pycache__ directories and .pyc files in a single walk of the tree"""
+        for root, dirs, files in os.walk(os.curdir):
+            # Hidden directories (.git and friends) were never matched by the glob patterns used before
+            dirs[:] = [directory for directory in dirs if not directory.startswith('.')]
+            if '__pycache__' in dirs:
+                dirs.remove('__pycache__')
+                shutil.rmtree(os.path.join(root, '__pycache__'), ignore_errors=True)
+            CleanCommand.rm_all_files(os.path.join(root, file) for file in files if file.endswith('.pyc'))
+
     def run(self) -> None:
         """Remove temporary files and directories."""
         os.chdir(my_dir)
-        self.rm_all_files(glob.glob('./build/*'))
-        self.rm_all_files(glob.glob('./**/__pycache__/*', recursive=True))
-        self.rm_all_files(glob.glob('./**/*.pyc', recursive=True))
-        self.rm_all_files(glob.glob('./dist/*'))
-        self.rm_all_files(glob.glob('./*.egg-info'))
-        self.rm_all_files(glob.glob('./docker-context-files/*.whl'))
-        self.rm_all_files(glob.glob('./docker-context-files/*.tgz'))
+        self.rm_all_files(glob.iglob('./build/*'))
+        self.rm_all_compiled_files()
+        self.rm_all_files(glob.iglob('./dist/*'))
+        self.rm_all_files(glob.iglob('./*.egg-info'))
+        self.rm_all_files(glob.iglob('./docker-context-files/*.whl'))
+        self.rm_all_files(glob.iglob('./docker-context-files/*.tgz'))
 
 
 class CompileAssets(Command):
@@ -132,6 +146,7 @@ class ListExtras(Command):
         print("\n".join(wrap(", ".join(EXTRAS_REQUIREMENTS.keys()), 100)))
 
 
+@lru_cache(maxsize=None)
 def git_version(version_: str) -> str:
     """
     Return a version to identify the state of the underlying git repo. The version will
@@ -141,40 +156,56 @@ def git_version(version_: str) -> str:
     branch head. Finally, a "dirty" suffix is appended to indicate that uncommitted
     changes are present.
 
+    The git binary is called directly rather than through gitpython, whose import alone costs
+    more than the two git calls, and the result is cached for the lifetime of the process.
+
     :param str version_: Semver version
     :return: Found Airflow version in Git repo
     :rtype: str
     """
+    if not os.path.exists(os.path.join(my_dir, '.git')):
+        logger.warning('.git directory not found: Cannot compute the git version')
+        return ''
+    git_command = ["git", "-C", my_dir or os.curdir]
     try:
-        import git
-
-        try:
-            repo = git.Repo(os.path.join(*[my_dir, '.git']))
-        except git.NoSuchPathError:
-            logger.warning('.git directory not found: Cannot compute the git version')
-            return ''
-        except git.InvalidGitRepositoryError:
-            logger.warning('Invalid .git directory not found: Cannot compute the git version')
-            return ''
-    except ImportError:
-        logger.warning('gitpython not found: Cannot compute the git version.')
+        sha = subprocess.check_output(
+            [*git_command, "rev-parse", "HEAD"], stderr=subprocess.DEVNULL, universal_newlines=True
+        ).strip()
+        # Same semantics as gitpython's is_dirty(): staged or unstaged changes, untracked files ignored
+        changes = subprocess.check_output(
+            [*git_command, "status", "--porcelain", "--untracked-files=no"],
+            stderr=subprocess.DEVNULL,
+            universal_newlines=True,
+        )
+    except FileNotFoundError:
+        logger.warning('git not found: Cannot compute the git version.')
+        return ''
+    except subprocess.CalledProcessError as e:
+        logger.warning('Git command failed (%s): Cannot compute the git version', e)
         return ''
-    if repo:
-        sha = repo.head.commit.hexsha
-        if repo.is_dirty():
+    if sha:
+        if changes.strip():
             return f'.dev0+{sha}.dirty'
         # commit is clean
         return f'.release:{version_}+{sha}'
     return 'no_git_version'
 
 
-def write_version(filename: str = os.path.join(*[my_dir, "airflow", "git_version"])) -> None:
+def write_version(filename: str = os.path.join(my_dir, "airflow", "git_version")) -> None:
     """
     Write the Semver version + git hash to file, e.g. ".dev0+2f635dc265e78db6708f59f68e8009abb92c1e65".
+    The file is left untouched if it already has the right content, so that its modification time
+    (and any cache depending on it) only changes together with the version.
 
     :param str filename: Destination file to write
     """
     text = f"{git_version(version)}"
+    try:
+        with open(filename) as file:
+            if file.read() == text:
+                return
+    except FileNotFoundError:
+        pass
     with open(filename, 'w') as file:
         file.write(text)
 
@@ -182,7 +213,8 @@ def write_version(filename: str = os.path.join(*[my_dir, "airflow", "git_version
 # We limit Pandas to <1.4 because Pandas 1.4 requires SQLAlchemy 1.4 which
 # We should remove the limits as soon as Flask App Builder releases version 3.4.4
 # Release candidate is there: https://pypi.org/project/Flask-AppBuilder/3.4.4rc1/
-pandas_requirement = 'pandas>=0.17.1, <1.4'
+# Interned so that it is the very same object as the interned strings produced by sort_extras_requirements.
+pandas_requirement = sys.intern('pandas>=0.17.1, <1.4')
 
 # 'Start dependencies group' and 'Start dependencies group' are mark for ./scripts/ci/check_order_setup.py
 # If you change this mark you should also change ./scripts/ci/check_order_setup.py
@@ -717,27 +749,15 @@ CORE_EXTRAS_REQUIREMENTS: Dict[str, List[str]] = {
     'virtualenv': virtualenv,
 }
 
-EXTRAS_REQUIREMENTS: Dict[str, List[str]] = deepcopy(CORE_EXTRAS_REQUIREMENTS)
-
-
-def add_extras_for_all_providers() -> None:
-    """
-    Adds extras for all providers.
-    By default all providers have the same extra name as provider id, for example
-    'apache.hive' extra has 'apache.hive' provider requirement.
-    """
-    for provider_name, provider_requirement in PROVIDERS_REQUIREMENTS.items():
-        EXTRAS_REQUIREMENTS[provider_name] = provider_requirement
-
-
-def add_additional_extras() -> None:
-    """Adds extras for all additional extras."""
-    for extra_name, extra_requirement in ADDITIONAL_EXTRAS_REQUIREMENTS.items():
-        EXTRAS_REQUIREMENTS[extra_name] = extra_requirement
-
-
-add_extras_for_all_providers()
-add_additional_extras()
+# All extras: core ones first, then one extra per provider and then the additional ones. Providers that
+# also extend the core (celery, cncf.kubernetes) take precedence over the core entries of the same name.
+# The core requirement lists are copied, so that sorting and de-duplicating the extras in place does
+# not change the dependency groups above - their order is verified by pre-commit after importing setup.py.
+EXTRAS_REQUIREMENTS: Dict[str, List[str]] = {
+    **{extra: list(requirements) for extra, requirements in CORE_EXTRAS_REQUIREMENTS.items()},
+    **PROVIDERS_REQUIREMENTS,
+    **ADDITIONAL_EXTRAS_REQUIREMENTS,
+}
 
 #############################################################################################################
 #  The whole section can be removed in Airflow 3.0 as those old aliases are deprecated in 2.* series
@@ -765,10 +785,12 @@ EXTRAS_DEPRECATED_ALIASES: Dict[str, str] = {
     'winrm': 'microsoft.winrm',
 }
 
-EXTRAS_DEPRECATED_ALIASES_NOT_PROVIDERS: List[str] = [
-    "crypto",
-    "webhdfs",
-]
+EXTRAS_DEPRECATED_ALIASES_NOT_PROVIDERS: FrozenSet[str] = frozenset(
+    [
+        "crypto",
+        "webhdfs",
+    ]
+)
 
 
 def add_extras_for_all_deprecated_aliases() -> None:
@@ -809,7 +831,7 @@ add_extras_for_all_deprecated_aliases()
 # All providers. It is used by pre-commits.
 ALL_PROVIDERS = list(PROVIDERS_REQUIREMENTS.keys())
 
-ALL_DB_PROVIDERS = [
+ALL_DB_PROVIDERS: Tuple[str, ...] = (
     'apache.cassandra',
     'apache.drill',
     'apache.druid',
@@ -827,14 +849,19 @@ ALL_DB_PROVIDERS = [
     'presto',
     'trino',
     'vertica',
-]
+)
 
-# Special requirements for all database-related providers. They are de-duplicated.
-all_dbs = list({req for db_provider in ALL_DB_PROVIDERS for req in PROVIDERS_REQUIREMENTS[db_provider]})
+# Special requirements for all database-related providers. They are de-duplicated (keeping the first
+# occurrence) so that the resulting order is deterministic.
+all_dbs = list(
+    dict.fromkeys(
+        chain.from_iterable(PROVIDERS_REQUIREMENTS[db_provider] for db_provider in ALL_DB_PROVIDERS)
+    )
+)
 
 # Requirements for all "user" extras (no devel). They are de-duplicated. Note that we do not need
 # to separately add providers requirements - they have been already added as 'providers' extras above
-_all_requirements = list({req for extras_reqs in EXTRAS_REQUIREMENTS.values() for req in extras_reqs})
+_all_requirements = list(dict.fromkeys(chain.from_iterable(EXTRAS_REQUIREMENTS.values())))
 
 # All user extras here
 EXTRAS_REQUIREMENTS["all"] = _all_requirements
@@ -844,26 +871,22 @@ EXTRAS_REQUIREMENTS["all_dbs"] = all_dbs + pandas
 
 # This can be simplified to devel_hadoop + _all_requirements due to inclusions
 # but we keep it for explicit sake. We are de-duplicating it anyway.
-devel_all = list(set(_all_requirements + doc + devel + devel_hadoop))
+devel_all = list(dict.fromkeys(chain(_all_requirements, doc, devel, devel_hadoop)))
 
-# Those are packages excluded for "all" dependencies
-PACKAGES_EXCLUDED_FOR_ALL = []
-PACKAGES_EXCLUDED_FOR_ALL.extend(
-    [
-        'snakebite',
-    ]
-)
+# Those are packages excluded for "all" dependencies. They are matched as prefixes of the requirement
+# (so 'snakebite' also excludes 'snakebite-py3'), which is why it is kept as a tuple for str.startswith.
+PACKAGES_EXCLUDED_FOR_ALL: Tuple[str, ...] = ('snakebite',)
 
 
-def is_package_excluded(package: str, exclusion_list: List[str]) -> bool:
+def is_package_excluded(package: str, exclusion_list: Tuple[str, ...]) -> bool:
     """
     Checks if package should be excluded.
 
     :param package: package name (beginning of it)
-    :param exclusion_list: list of excluded packages
+    :param exclusion_list: tuple of excluded package prefixes
     :return: true if package should be excluded
     """
-    return any(package.startswith(excluded_package) for excluded_package in exclusion_list)
+    return package.startswith(exclusion_list)
 
 
 devel_all = [
@@ -889,10 +912,19 @@ def sort_extras_requirements() -> Dict[str, List[str]]:
     The dictionary order remains when keys() are retrieved.
     Sort both: extras and list of dependencies to make it easier to analyse problems
     external packages will be first, then if providers are added they are added at the end of the lists.
+    The lists are also de-duplicated - an extra built out of several groups can get the same requirement
+    more than once. The same requirements appear in many extras, so the strings are interned while we are
+    at it - the lists then share single string objects, which are compared by identity first.
     """
     sorted_requirements = dict(sorted(EXTRAS_REQUIREMENTS.items()))
+    # Some of the lists are shared between extras (e.g. deprecated aliases) - each of them is sorted once,
+    # in place, so that the sharing is kept.
+    sorted_list_ids: Set[int] = set()
     for extra_list in sorted_requirements.values():
-        extra_list.sort()
+        if id(extra_list) in sorted_list_ids:
+            continue
+        sorted_list_ids.add(id(extra_list))
+        extra_list[:] = sorted(set(map(sys.intern, extra_list)))
     return sorted_requirements
 
 
@@ -901,14 +933,15 @@ EXTRAS_REQUIREMENTS = sort_extras_requirements()
 # Those providers are pre-installed always when airflow is installed.
 # Those providers do not have dependency on airflow2.0 because that would lead to circular dependencies.
 # This is not a problem for PIP but some tools (pipdeptree) show those as a warning.
-PREINSTALLED_PROVIDERS = [
+PREINSTALLED_PROVIDERS: Tuple[str, ...] = (
     'ftp',
     'http',
     'imap',
     'sqlite',
-]
+)
 
 
+@lru_cache(maxsize=None)
 def get_provider_package_from_package_id(package_id: str) -> str:
     """
     Builds the name of provider package out of the package id provided/
@@ -920,22 +953,29 @@ def get_provider_package_from_package_id(package_id: str) -> str:
     return f"apache-airflow-providers-{package_suffix}"
 
 
-def get_excluded_providers() -> List[str]:
-    """
-    Returns packages excluded for the current python version.
-    Currently the only excluded provider is apache hive for Python 3.9.
-    Until https://github.com/dropbox/PyHive/issues/380 is fixed.
-    """
-    return ['apache.hive'] if PY39 else []
+# Names of the PyPI packages of all the providers (e.g. 'microsoft.azure' ->
+# 'apache-airflow-providers-microsoft-azure')
+PROVIDER_PACKAGE_NAMES: Dict[str, str] = {
+    package_id: get_provider_package_from_package_id(package_id) for package_id in PROVIDERS_REQUIREMENTS
+}
+
+# Providers excluded for the current python version.
+# Currently the only excluded provider is apache hive for Python 3.9.
+# Until https://github.com/dropbox/PyHive/issues/380 is fixed.
+EXCLUDED_PROVIDERS: FrozenSet[str] = frozenset(['apache.hive']) if PY39 else frozenset()
+
+
+def get_excluded_providers() -> FrozenSet[str]:
+    """Returns packages excluded for the current python version."""
+    return EXCLUDED_PROVIDERS
 
 
 def get_all_provider_packages() -> str:
     """Returns all provider packages configured in setup.py"""
-    excluded_providers = get_excluded_providers()
     return " ".join(
-        get_provider_package_from_package_id(package)
-        for package in PROVIDERS_REQUIREMENTS
-        if package not in excluded_providers
+        package_name
+        for package, package_name in PROVIDER_PACKAGE_NAMES.items()
+        if package not in EXCLUDED_PROVIDERS
     )
 
 
@@ -945,6 +985,13 @@ class AirflowDistribution(Distribution):
     def __init__(self, attrs=None):
         super().__init__(attrs)
         self.install_requires = None
+        self._config_files_parsed = False
+
+    def get_command_class(self, command: str) -> Type[Command]:
+        """Builds the lazily defined Airflow commands the first time they are requested."""
+        if command not in self.cmdclass and command in LAZY_COMMANDS:
+            self.cmdclass[command] = LAZY_COMMANDS[command]()
+        return super().get_command_class(command)
 
     def parse_config_files(self, *args, **kwargs) -> None:
         """
@@ -952,7 +999,13 @@ class AirflowDistribution(Distribution):
         that we don't *also* try to install those providers from PyPI.
         Also we should make sure that in this case we copy provider.yaml files so that
         Providers manager can find package information.
+
+        The adjustments are not idempotent (and walking the providers tree is not free), so subsequent
+        calls are no-ops.
         """
+        if self._config_files_parsed:
+            return
+        self._config_files_parsed = True
         super().parse_config_files(*args, **kwargs)
         if os.getenv(INSTALL_PROVIDERS_FROM_SOURCES) == 'true':
             self.install_requires = [
@@ -968,7 +1021,7 @@ class AirflowDistribution(Distribution):
             )
 
 
-def replace_extra_requirement_with_provider_packages(extra: str, providers: List[str]) -> None:
+def replace_extra_requirement_with_provider_packages(extra: str, providers: Iterable[str]) -> None:
     """
     Replaces extra requirement with provider package. The intention here is that when
     the provider is added as dependency of extra, there is no need to add the dependencies
@@ -996,24 +1049,24 @@ def replace_extra_requirement_with_provider_packages(extra: str, providers: List
     version, which means that installation using constraints is repeatable.
 
     :param extra: Name of the extra to add providers to
-    :param providers: list of provider ids
+    :param providers: provider ids
     """
     EXTRAS_REQUIREMENTS[extra] = [
         get_provider_package_from_package_id(package_name) for package_name in providers
     ]
 
 
-def add_provider_packages_to_extra_requirements(extra: str, providers: List[str]) -> None:
+def add_provider_packages_to_extra_requirements(extra: str, providers: Iterable[str]) -> None:
     """
     Adds provider packages as requirements to extra. This is used to add provider packages as requirements
     to the "bulk" kind of extras. Those bulk extras do not have the detailed 'extra' requirements as
     initial values, so instead of replacing them (see previous function) we can extend them.
 
     :param extra: Name of the extra to add providers to
-    :param providers: list of provider ids
+    :param providers: provider ids
     """
     EXTRAS_REQUIREMENTS[extra].extend(
-        [get_provider_package_from_package_id(package_name) for package_name in providers]
+        get_provider_package_from_package_id(package_name) for package_name in providers
     )
 
 
@@ -1027,48 +1080,140 @@ def add_all_provider_packages() -> None:
     as the new provider is not yet in PyPI.
 
     """
-    for provider in ALL_PROVIDERS:
-        replace_extra_requirement_with_provider_packages(provider, [provider])
-    add_provider_packages_to_extra_requirements("all", ALL_PROVIDERS)
-    add_provider_packages_to_extra_requirements("devel_ci", ALL_PROVIDERS)
-    add_provider_packages_to_extra_requirements("devel_all", ALL_PROVIDERS)
+    # The package names of all providers are needed for every provider extra and for each of the bulk
+    # extras, so they are resolved once and reused.
+    all_provider_packages = [get_provider_package_from_package_id(provider) for provider in ALL_PROVIDERS]
+    for provider, provider_package in zip(ALL_PROVIDERS, all_provider_packages):
+        EXTRAS_REQUIREMENTS[provider] = [provider_package]
+    for extra in ("all", "devel_ci", "devel_all"):
+        EXTRAS_REQUIREMENTS[extra].extend(all_provider_packages)
     add_provider_packages_to_extra_requirements("all_dbs", ALL_DB_PROVIDERS)
     add_provider_packages_to_extra_requirements(
         "devel_hadoop", ["apache.hdfs", "apache.hive", "presto", "trino"]
     )
     add_all_deprecated_provider_packages()
+    # Provider packages might now be listed twice in the bulk extras (devel_ci and devel_all are even the
+    # same list, and some providers are requirements of other providers) - de-duplicate them in place.
+    for requirements in EXTRAS_REQUIREMENTS.values():
+        requirements[:] = dict.fromkeys(requirements)
 
 
-class Develop(develop_orig):
-    """Forces removal of providers in editable mode."""
+def get_installed_provider_packages() -> List[str]:
+    """
+    Returns names of the provider packages installed in the current environment.
+    Installed distributions are read in-process with importlib.metadata, which is much cheaper than
+    running ``pip freeze``. Only on Python 3.7, where importlib.metadata is missing, pip is used instead.
+    """
+    try:
+        from importlib.metadata import distributions
+    except ImportError:
+        installed_packages = (
+            subprocess.check_output([sys.executable, "-m", "pip", "freeze"]).decode().splitlines()
+        )
+        installed_names = (package_line.partition("=")[0] for package_line in installed_packages)
+    else:
+        installed_names = (distribution.metadata["Name"] or "" for distribution in distributions())
+    # The same distribution can be found more than once (for example when it is present in several
+    # sys.path entries) - it should be uninstalled only once.
+    return list(
+        dict.fromkeys(name for name in installed_names if name.startswith("apache-airflow-providers"))
+    )
 
-    def run(self) -> None:  # type: ignore
-        self.announce('Installing in editable mode. Uninstalling provider packages!', level=log.INFO)
-        # We need to run "python3 -m pip" because it might be that older PIP binary is in the path
-        # And it results with an error when running pip directly (cannot import pip module)
-        # also PIP does not have a stable API so we have to run subprocesses ¯\_(ツ)_/¯
-        try:
-            installed_packages = (
-                subprocess.check_output(["python3", "-m", "pip", "freeze"]).decode().splitlines()
-            )
-            airflow_provider_packages = [
-                package_line.split("=")[0]
-                for package_line in installed_packages
-                if package_line.startswith("apache-airflow-providers")
-            ]
-            self.announce(f'Uninstalling ${airflow_provider_packages}!', level=log.INFO)
-            subprocess.check_call(["python3", "-m", "pip", "uninstall", "--yes", *airflow_provider_packages])
-        except subprocess.CalledProcessError as e:
-            self.announce(f'Error when uninstalling airflow provider packages: {e}!', level=log.WARN)
-        super().run()
 
+def uninstall_packages(packages: List[str]) -> None:
+    """
+    Uninstalls the packages with a single pip call. The names are passed in a requirements file rather than
+    as arguments, so that the command line stays short however many packages are uninstalled.
 
-class Install(install_orig):
-    """Forces installation of providers from sources in editable mode."""
+    :param packages: names of the packages to uninstall
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        requirements_file = os.path.join(tmp_dir, 'requirements.txt')
+        with open(requirements_file, 'w') as file:
+            file.write("\n".join(packages))
+        subprocess.check_call(
+            [sys.executable, "-m", "pip", "uninstall", "--yes", "--requirement", requirements_file]
+        )
 
-    def run(self) -> None:
-        self.announce('Standard installation. Providers are installed from packages', level=log.INFO)
-        super().run()
+
+def get_develop_command() -> Type[Command]:
+    """
+    Returns the Airflow 'develop' command. The setuptools base command (which pulls in easy_install)
+    is only imported when the command is actually requested - see ``AirflowDistribution.get_command_class``.
+    """
+    from setuptools.command.develop import develop as develop_orig
+
+    # Setuptools patches this import to point to a vendored copy instead of the
+    # stdlib, which is deprecated in Python 3.10 and will be removed in 3.12.
+    from distutils import log  # isort: skip
+
+    class Develop(develop_orig):
+        """Forces removal of providers in editable mode."""
+
+        def run(self) -> None:  # type: ignore
+            self.announce('Installing in editable mode. Uninstalling provider packages!', level=log.INFO)
+            # We need to run "<this python> -m pip" because it might be that older PIP binary is in the path
+            # And it results with an error when running pip directly (cannot import pip module). Using the
+            # interpreter that runs setup.py also makes pip act on the same environment in which the
+            # installed providers were found.
+            # Also PIP does not have a stable API so we have to run subprocesses ¯\_(ツ)_/¯
+            try:
+                airflow_provider_packages = get_installed_provider_packages()
+                if airflow_provider_packages:
+                    self.announce(f'Uninstalling ${airflow_provider_packages}!', level=log.INFO)
+                    uninstall_packages(airflow_provider_packages)
+            except Exception as e:
+                # Removing the providers is best-effort - neither a failing pip call nor a broken
+                # distribution met while scanning the installed ones should abort the develop command
+                self.announce(f'Error when uninstalling airflow provider packages: {e}!', level=log.WARN)
+            super().run()
+
+    return Develop
+
+
+def get_install_command() -> Type[Command]:
+    """
+    Returns the Airflow 'install' command. The setuptools base command is only imported when the
+    command is actually requested - see ``AirflowDistribution.get_command_class``.
+    """
+    from setuptools.command.install import install as install_orig
+
+    # Setuptools patches this import to point to a vendored copy instead of the stdlib
+    from distutils import log  # isort: skip
+
+    class Install(install_orig):
+        """Forces installation of providers from sources in editable mode."""
+
+        def run(self) -> None:
+            self.announce('Standard installation. Providers are installed from packages', level=log.INFO)
+            super().run()
+
+    return Install
+
+
+# Commands whose classes are only built when setuptools asks for them
+LAZY_COMMANDS: Dict[str, Callable[[], Type[Command]]] = {
+    'develop': get_develop_command,
+    'install': get_install_command,
+}
+
+
+def find_airflow_namespace_packages() -> List[str]:
+    """
+    Returns all namespace packages found below airflow (including airflow itself). It is equivalent to
+    ``find_namespace_packages(include=['airflow*'])`` but only walks the airflow directory instead of the
+    whole source tree, and it does not descend into directories that can never be packages (hidden ones,
+    ``__pycache__`` or the ``node_modules`` of the www assets).
+    """
+    packages = []
+    for dir_path, dir_names, _ in os.walk('airflow'):
+        dir_names[:] = [
+            dir_name
+            for dir_name in dir_names
+            if '.' not in dir_name and dir_name not in ('__pycache__', 'node_modules')
+        ]
+        packages.append(dir_path.replace(os.sep, '.'))
+    return packages
 
 
 def do_setup() -> None:
@@ -1080,17 +1225,11 @@ def do_setup() -> None:
     """
     setup_kwargs = {}
 
-    def include_provider_namespace_packages_when_installing_from_sources() -> None:
-        """
-        When installing providers from sources we install all namespace packages found below airflow,
-        including airflow and provider packages, otherwise defaults from setup.cfg control this.
-        The kwargs in setup() call override those that are specified in setup.cfg.
-        """
-        if os.getenv(INSTALL_PROVIDERS_FROM_SOURCES) == 'true':
-            setup_kwargs['packages'] = find_namespace_packages(include=['airflow*'])
-
-    include_provider_namespace_packages_when_installing_from_sources()
     if os.getenv(INSTALL_PROVIDERS_FROM_SOURCES) == 'true':
+        # When installing providers from sources we install all namespace packages found below airflow,
+        # including airflow and provider packages, otherwise defaults from setup.cfg control this.
+        # The kwargs in setup() call override those that are specified in setup.cfg.
+        setup_kwargs['packages'] = find_airflow_namespace_packages()
         print("Installing providers from sources. Skip adding providers as dependencies")
     else:
         add_all_provider_packages()
@@ -1099,14 +1238,13 @@ def do_setup() -> None:
     setup(
         distclass=AirflowDistribution,
         version=version,
-        extras_require=EXTRAS_REQUIREMENTS,
+        # The extras are final at this point - hand them over as immutable tuples
+        extras_require={extra: tuple(requirements) for extra, requirements in EXTRAS_REQUIREMENTS.items()},
         download_url=('https://archive.apache.org/dist/airflow/' + version),
         cmdclass={
             'extra_clean': CleanCommand,
             'compile_assets': CompileAssets,
             'list_extras': ListExtras,
-            'install': Install,  # type: ignore
-            'develop': Develop,
         },
         test_suite='setup.airflow_test_suite',
         **setup_kwargs,  # type: ignore